@@ -1,15 +1,19 @@
 import sqlite3
 import logging
+from bisect import bisect_left
+from collections import OrderedDict, deque, namedtuple
 from typing import Optional, Tuple
 from telegram import Chat, ChatMember, ChatMemberUpdated, Update, InlineKeyboardMarkup, InlineKeyboardButton, \
-    KeyboardButton, ReplyKeyboardMarkup
+    KeyboardButton, ReplyKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
 from telegram.constants import ParseMode
 from telegram.ext import (
     Application,
     ChatMemberHandler,
     CommandHandler,
     ContextTypes,
+    InlineQueryHandler,
     MessageHandler,
+    TypeHandler,
     filters, CallbackContext, ConversationHandler
 )
 
@@ -26,6 +30,28 @@ logger = logging.getLogger(__name__)
 DATABASE_FILE = 'non.db'
 CHOOSE_TYPE, LINK_OR_FILE, FUNCTIONALITY, CONFIRM = range(4)
 DESCRIBE_PROBLEM, LANGUAGE, SCREENSHOT, ERROR_MESSAGE, CONFIRMATION = range(5)
+
+#parametres du mode inline
+INLINE_PAGE_SIZE = 50  # maximum accepte par Telegram pour une reponse
+INLINE_CACHE_TIME = 30  # secondes pendant lesquelles Telegram garde la reponse en cache
+INLINE_CACHE_SIZE = 256  # nombre de requetes gardees dans le cache du bot
+RECENT_REQUESTS_LIMIT = 50  # nombre de demandes recentes indexees
+INLINE_MESSAGE_LIMIT = 4096  # taille maximale d'un message Telegram
+
+#priorites des mises a jour et seuils de delestage (taille de la file d'attente)
+PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW = range(3)
+SHEDDING_NORMAL, SHEDDING_DEGRADED, SHEDDING_SHEDDING = "normal", "degrade", "delestage"
+SHEDDING_DEGRADE_THRESHOLD = 20  # au dela, les messages de bienvenue ne sont plus envoyes
+SHEDDING_SHED_THRESHOLD = 100  # au dela, les mises a jour peu prioritaires sont reportees
+DEFERRED_MESSAGES_LIMIT = 1000  # au dela, les messages de bienvenue/depart sont ignores au lieu d'etre reportes
+DEFERRED_DRAIN_BATCH = 10  # nombre de messages reportes envoyes a chaque passage
+DEFERRED_DRAIN_INTERVAL = 5  # secondes entre deux passages
+
+# index par prefixe et cache des resultats, reconstruits apres chaque modification
+IndexInline = namedtuple("IndexInline", ["cles", "entrees", "member_ids"])
+_inline_index = None
+_inline_cache = OrderedDict()
+
 #creation des tables
 def create_database():
     """Crée la base de données et la table si elles n'existent pas."""
@@ -49,6 +75,15 @@ def create_database():
             title TEXT
         )
     ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS demandes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            userid INTEGER,
+            usernom TEXT,
+            type TEXT,              -- 'test' ou 'probleme'
+            resume TEXT
+        )
+    ''')
 
     conn.commit()
     conn.close()
@@ -76,6 +111,7 @@ async def increment_nbpb(user_id: int) -> bool:
     # Fermer la connexion
     conn.close()
 
+    invalider_index_inline()
     return True
   except Exception as e:
     print(f"Erreur lors de la mise à jour du nbpb: {e}")
@@ -115,6 +151,7 @@ def ajouter_utilisateur(userid, username, rank, nbaide, nbpb, isowner=False):
         ''', (userid, username, rank, nbaide, nbpb, isowner))
 
         conn.commit()
+        invalider_index_inline()
         print(f"L'utilisateur {username} (ID: {userid}) a été ajouté avec succès.")
 
     except sqlite3.IntegrityError:
@@ -151,12 +188,143 @@ def supprimer_utilisateur(userid):
             DELETE FROM users WHERE id = ?
         ''', (userid,))
         conn.commit()
+        invalider_index_inline()
         print(f"L'utilisateur avec l'ID {userid} a été supprimé avec succès.")
     except sqlite3.OperationalError:
         print(f"L'utilisateur avec l'ID {userid} n'existe pas dans la base de données.")
     finally:
         conn.close()
 
+def ajouter_demande(userid, username, type_demande, resume):
+    """Enregistre une demande de test ou de probleme pour la recherche inline.
+
+    Si la table 'demandes' n'existe pas, elle sera créée.
+    """
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS demandes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                userid INTEGER,
+                usernom TEXT,
+                type TEXT,
+                resume TEXT
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO demandes (userid, usernom, type, resume)
+            VALUES (?, ?, ?, ?)
+        ''', (userid, username, type_demande, resume[:INLINE_MESSAGE_LIMIT]))
+        conn.commit()
+        invalider_index_inline()
+    except sqlite3.Error as e:
+        print(f"Erreur lors de l'enregistrement de la demande: {e}")
+    finally:
+        conn.close()
+
+def invalider_index_inline():
+    """Vide l'index inline et son cache apres une modification de la base."""
+    global _inline_index
+    _inline_index = None
+    _inline_cache.clear()
+
+def construire_index_inline():
+    """Construit l'index par prefixe des membres et des demandes recentes.
+
+    Retourne un IndexInline ou 'cles' est une liste triee de (mot, position de
+    l'entree) utilisee pour la recherche par prefixe.
+    """
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT id, usernom, rank, nbpb FROM users ORDER BY usernom")
+    users = cursor.fetchall()
+    try:
+        cursor.execute("SELECT id, userid, usernom, type, resume FROM demandes ORDER BY id DESC LIMIT ?",
+                       (RECENT_REQUESTS_LIMIT,))
+        demandes = cursor.fetchall()
+    except sqlite3.OperationalError:
+        # La table 'demandes' n'existe pas encore
+        demandes = []
+
+    conn.close()
+
+    entrees = []
+    cles = []
+    for user_id, username, rank, nbpb in users:
+        # Telegram refuse un titre vide
+        username = username or f"Membre {user_id}"
+        texte = (f"NOM: {username} \n"
+                 f"RANG: {rank} \n"
+                 f"Nombre de participassion: {nbpb}")
+        entrees.append((f"membre-{user_id}", username, f"Rang: {rank} - Participations: {nbpb}", texte))
+        for mot in username.lower().split() + ["membre"]:
+            cles.append((mot, len(entrees) - 1))
+    for demande_id, userid, username, type_demande, resume in demandes:
+        username = username or f"Membre {userid}"
+        resume = resume or ""
+        texte = (f"Demande de {type_demande} de {username}\n"
+                 f"\n"
+                 f"{resume}")[:INLINE_MESSAGE_LIMIT]
+        entrees.append((f"demande-{demande_id}", f"{type_demande.capitalize()} - {username}", resume[:100], texte))
+        for mot in f"{username} {type_demande} {resume}".lower().split():
+            cles.append((mot, len(entrees) - 1))
+    cles.sort()
+
+    member_ids = {user[0] for user in users}
+    return IndexInline(cles, entrees, member_ids)
+
+def obtenir_index_inline() -> IndexInline:
+    """Retourne l'index inline, en le construisant s'il a ete invalide."""
+    global _inline_index
+    if _inline_index is None:
+        _inline_index = construire_index_inline()
+    return _inline_index
+
+def rechercher_inline(query: str) -> list:
+    """Retourne les resultats inline correspondant a la requete.
+
+    Chaque mot de la requete doit etre le prefixe d'un mot indexe. Les resultats sont
+    gardes dans un cache LRU jusqu'a la prochaine modification de la base.
+    """
+    query = " ".join(query.lower().split())
+    if query in _inline_cache:
+        _inline_cache.move_to_end(query)
+        return _inline_cache[query]
+
+    index = obtenir_index_inline()
+    cles, entrees = index.cles, index.entrees
+
+    if query:
+        positions = None
+        for mot in query.split():
+            trouves = set()
+            i = bisect_left(cles, (mot,))
+            while i < len(cles) and cles[i][0].startswith(mot):
+                trouves.add(cles[i][1])
+                i += 1
+            positions = trouves if positions is None else positions & trouves
+        positions = sorted(positions)
+    else:
+        positions = range(len(entrees))
+
+    resultats = [
+        InlineQueryResultArticle(
+            id=entrees[i][0],
+            title=entrees[i][1],
+            description=entrees[i][2],
+            input_message_content=InputTextMessageContent(entrees[i][3]),
+        )
+        for i in positions
+    ]
+
+    _inline_cache[query] = resultats
+    if len(_inline_cache) > INLINE_CACHE_SIZE:
+        _inline_cache.popitem(last=False)
+    return resultats
+
 def extract_status_change(chat_member_update: ChatMemberUpdated) -> Optional[Tuple[bool, bool]]:
     """Takes a ChatMemberUpdated instance and extracts whether the 'old_chat_member' was a member
     of the chat and whether the 'new_chat_member' is a member of the chat. Returns None, if
@@ -182,6 +350,102 @@ def extract_status_change(chat_member_update: ChatMemberUpdated) -> Optional[Tup
 
     return was_member, is_member
 
+def classify_update(update: Update) -> int:
+    """Retourne la priorite d'une mise a jour selon son type.
+
+    Les messages (etapes des conversations /test et /probleme, commandes) sont
+    prioritaires, les arrivees/departs de membres passent en dernier.
+    """
+    if update.message or update.edited_message or update.callback_query:
+        return PRIORITY_HIGH
+    if update.chat_member:
+        return PRIORITY_LOW
+    return PRIORITY_NORMAL
+
+def shedding_state(queue_depth: int) -> str:
+    """Retourne l'etat de delestage correspondant a la taille de la file d'attente."""
+    if queue_depth >= SHEDDING_SHED_THRESHOLD:
+        return SHEDDING_SHEDDING
+    if queue_depth >= SHEDDING_DEGRADE_THRESHOLD:
+        return SHEDDING_DEGRADED
+    return SHEDDING_NORMAL
+
+def get_shedding_metrics(bot_data: dict) -> dict:
+    """Retourne les metriques de delestage stockees dans bot_data["shedding"]."""
+    return bot_data.setdefault("shedding", {
+        "state": SHEDDING_NORMAL,
+        "queue_depth": 0,
+        "max_queue_depth": 0,
+        "admitted": {PRIORITY_HIGH: 0, PRIORITY_NORMAL: 0, PRIORITY_LOW: 0},
+        "deferred": 0,
+        "sent_deferred": 0,
+        "degraded": 0,
+    })
+
+def update_shedding_state(bot_data: dict, queue_depth: int) -> str:
+    """Met a jour l'etat de delestage et la taille de la file dans les metriques."""
+    metrics = get_shedding_metrics(bot_data)
+    state = shedding_state(queue_depth)
+    if state != metrics["state"]:
+        logger.info("Delestage: %s -> %s (file: %s)", metrics["state"], state, queue_depth)
+    metrics["state"] = state
+    metrics["queue_depth"] = queue_depth
+    metrics["max_queue_depth"] = max(metrics["max_queue_depth"], queue_depth)
+    return state
+
+async def admission_control(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Classe les mises a jour avant les autres handlers selon la charge.
+
+    Met a jour l'etat de delestage et les metriques dans context.bot_data["shedding"].
+    Les handlers peu prioritaires consultent cet etat pour alleger leur travail.
+    """
+    update_shedding_state(context.bot_data, context.application.update_queue.qsize())
+    priority = classify_update(update)
+    get_shedding_metrics(context.bot_data)["admitted"][priority] += 1
+
+async def send_or_defer_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str,
+                                parse_mode: Optional[str] = None) -> None:
+    """Envoie un message peu prioritaire, ou le reporte si le bot est surcharge.
+
+    Seul l'envoi est reporte: les ecritures en base sont faites avant l'appel.
+    Si trop de messages sont deja en attente, le message est ignore.
+    """
+    metrics = get_shedding_metrics(context.bot_data)
+    if metrics["state"] == SHEDDING_NORMAL:
+        await context.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+        return
+
+    deferred = context.bot_data.setdefault("deferred_messages", deque())
+    if len(deferred) < DEFERRED_MESSAGES_LIMIT:
+        deferred.append((chat_id, text, parse_mode))
+        metrics["deferred"] += 1
+    else:
+        metrics["degraded"] += 1
+
+async def drain_deferred_messages(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Envoie les messages reportes, par petits lots.
+
+    Appelee periodiquement par le job_queue pour que les messages partent meme
+    si plus aucune mise a jour n'arrive. On s'arrete des que la file atteint le
+    seuil de degradation.
+    """
+    update_queue = context.application.update_queue
+    update_shedding_state(context.bot_data, update_queue.qsize())
+    deferred = context.bot_data.get("deferred_messages")
+    if not deferred:
+        return
+
+    metrics = get_shedding_metrics(context.bot_data)
+    for _ in range(DEFERRED_DRAIN_BATCH):
+        if not deferred or update_queue.qsize() >= SHEDDING_DEGRADE_THRESHOLD:
+            break
+        chat_id, text, parse_mode = deferred.popleft()
+        try:
+            await context.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+            metrics["sent_deferred"] += 1
+        except Exception as e:
+            logger.warning("Echec de l'envoi d'un message reporte a %s: %s", chat_id, e)
+
 async def track_chats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Tracks the chats the bot is in."""
     result = extract_status_change(update.my_chat_member)
@@ -233,7 +497,9 @@ async def greet_chat_members(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     if not was_member and is_member:
         ajouter_utilisateur(member_id, meber_name, 0, 0, 0)
-        await update.effective_chat.send_message(
+        await send_or_defer_message(
+            context,
+            update.effective_chat.id,
             f"{member_name} 👋 Bienvenue dans notre communauté d'informaticiens ! 🎉"
             f"Nous sommes ravis de t'accueillir parmi nous. Si tu as des questions sur "
             f"le fonctionnement de la communauté ou si tu souhaites en savoir plus sur "
@@ -247,7 +513,9 @@ async def greet_chat_members(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
     elif was_member and not is_member:
         supprimer_utilisateur(member_id)
-        await update.effective_chat.send_message(
+        await send_or_defer_message(
+            context,
+            update.effective_chat.id,
             f"{member_name} is no longer with us. Thanks a lot, {cause_name} ...",
             parse_mode=ParseMode.HTML,
         )
@@ -384,7 +652,7 @@ async def setting(update: Update, context: CallbackContext) -> None:
         if isowner:
             await update.message.reply_text(f"Bienvenue a toi Admin {username} voila les commandes "
                                             f"pour la gestion du groupe"
-                                            f"/list, /grads, /degrad ")
+                                            f"/list, /grads, /degrad, /charge ")
         else:
             await update.message.reply_text("Cet Partie est seulement pour les Admins")
     else:
@@ -451,6 +719,65 @@ async def me(update: Update, context: CallbackContext) -> None:
         # L'utilisateur n'est pas enregistré
         await update.message.reply_text("Cet utilisateur n'est pas enregistré dans la base de données.")
 
+async def inline_query(update: Update, context: CallbackContext) -> None:
+    """Fonction appelée lors d'une requete inline (@bot <recherche>).
+
+    Recherche les membres et les demandes recentes, page par page.
+    """
+    query = update.inline_query
+
+    if query.from_user.id not in obtenir_index_inline().member_ids:
+        # L'utilisateur n'est pas enregistré
+        await query.answer([], cache_time=INLINE_CACHE_TIME, is_personal=True)
+        return
+
+    try:
+        offset = int(query.offset or 0)
+    except ValueError:
+        offset = 0
+
+    resultats = rechercher_inline(query.query)
+    page = resultats[offset:offset + INLINE_PAGE_SIZE]
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(resultats) else ""
+
+    await query.answer(page, cache_time=INLINE_CACHE_TIME, is_personal=True, next_offset=next_offset)
+
+async def charge(update: Update, context: CallbackContext) -> None:
+    """Fonction appelée lors de la commande /charge.
+
+    Affiche les metriques de delestage aux admins.
+    """
+    user_id = update.effective_user.id
+
+    # Connexion à la base de données
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+
+    # Récupération des informations de l'utilisateur
+    cursor.execute("SELECT isowner FROM users WHERE id = ?", (user_id,))
+    user_data = cursor.fetchone()
+
+    # Fermeture de la connexion
+    conn.close()
+
+    if user_data and user_data[0]:
+        metrics = context.bot_data.get("shedding")
+        if metrics is None:
+            await update.message.reply_text("Aucune metrique disponible pour le moment.")
+            return
+        admitted = metrics["admitted"]
+        await update.message.reply_text(
+            f"Etat: {metrics['state']}\n"
+            f"File d'attente: {metrics['queue_depth']} (max: {metrics['max_queue_depth']})\n"
+            f"Admises: haute {admitted[PRIORITY_HIGH]}, normale {admitted[PRIORITY_NORMAL]}, "
+            f"basse {admitted[PRIORITY_LOW]}\n"
+            f"Messages reportes: {metrics['deferred']} (en attente: {len(context.bot_data.get('deferred_messages', ()))})\n"
+            f"Messages reportes envoyes: {metrics['sent_deferred']}\n"
+            f"Messages ignores: {metrics['degraded']}"
+        )
+    else:
+        await update.message.reply_text("Cet Partie est seulement pour les Admins")
+
 async def handle_type(update: Update, context: CallbackContext) -> int:
     """Handles the application type input."""
     app_type = update.message.text.lower()
@@ -519,6 +846,8 @@ async def confirm(update: Update, context: CallbackContext) -> int:
             await context.bot.send_message(chat_id=grooupid, text=message)
             await context.bot.send_document(chat_id=grooupid, document=context.user_data.get('file'),
                                             caption=f"{update.effective_user.full_name}")
+        ajouter_demande(update.effective_user.id, update.effective_user.full_name, "test",
+                        f"{context.user_data['app_type']} - {context.user_data['functionality']}")
         await increment_nbpb(update.effective_user.id)
         await update.message.reply_text("Merci! La demande de test a été envoyée au groupe.")
         return ConversationHandler.END
@@ -627,6 +956,8 @@ async def confirme(update: Update, context: CallbackContext) -> int:
         )
         await context.bot.send_message(chat_id=grooupid, text=message)
         await update.message.reply_text("Merci! Votre demande d'aide a été envoyée au groupe.")
+        ajouter_demande(update.effective_user.id, update.effective_user.full_name, "probleme",
+                        f"{language} - {problem_description}")
         await increment_nbpb(update.effective_user.id)
         return ConversationHandler.END
     elif update.message.text == "non":
@@ -641,6 +972,10 @@ def main() -> None:
     # Create the Application and pass it your bot's token.
     application = Application.builder().token("7247373724:AAFiROYGTTWC5qvda-AOanefpMCfLP3rJCc").build()
 
+    # Admission des mises a jour selon leur priorite et la charge, avant tous les autres handlers
+    application.add_handler(TypeHandler(Update, admission_control), group=-1)
+    application.job_queue.run_repeating(drain_deferred_messages, interval=DEFERRED_DRAIN_INTERVAL)
+
     # Keep track of which chats the bot is in
     application.add_handler(ChatMemberHandler(track_chats, ChatMemberHandler.MY_CHAT_MEMBER))
 
@@ -686,6 +1021,8 @@ def main() -> None:
     )
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('me', me))
+    application.add_handler(CommandHandler('charge', charge))
+    application.add_handler(InlineQueryHandler(inline_query))
     application.add_handler(conv_handler)
     application.add_handler(conv_handlerpb)
     application.run_polling(allowed_updates=Update.ALL_TYPES)